@@ -1,5 +1,9 @@
 from argparse import ArgumentParser
+import hashlib
+import json
+import os
 import random
+import sys
 
 import xmlschema
 from xmlschema.validators import (
@@ -21,7 +25,7 @@ from xmlschema.validators import (
 
 import rstr
 from faker import Faker
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 # sample data is hardcoded
@@ -79,7 +83,11 @@ def valsmap(v):
 
 # The XML Generator class
 class GenXML:
-    def __init__(self, xsd, elem, enable_choice, row_tag, row_count, unbounded_count, force_optional):
+    def __init__(self, xsd, elem, enable_choice, row_tag, row_count, unbounded_count, force_optional,
+                 seed=None, reference_time=None, output=None, checkpoint=None, checkpoint_every=0, resume=False):
+        self.xsd_file = os.path.abspath(xsd)
+        with open(xsd, 'rb') as f:
+            self.xsd_hash = hashlib.sha256(f.read()).hexdigest()
         self.xsd = xmlschema.XMLSchema(xsd)
         self.elem = elem
         self.enable_choice = enable_choice
@@ -88,8 +96,134 @@ class GenXML:
         self.unbounded_count = int(unbounded_count)
         self.root = False
         self.vals = {}
-        self.faker = Faker()
         self.force_optional = bool(force_optional)
+        self.seed = random.getrandbits(32) if seed is None else int(seed)
+        # relative date ranges are anchored to a fixed time, so that a resumed job generates the same dates
+        if reference_time is None:
+            self.reference_time = datetime.now().replace(microsecond=0)
+        else:
+            self.reference_time = datetime.fromisoformat(reference_time)
+        self.output = output
+        self.out = None
+        self.checkpoint = checkpoint
+        self.checkpoint_every = int(checkpoint_every)
+        self.resume_state = None
+        self.silent = False
+        self.row_loop = 0
+        if resume:
+            self.load_checkpoint(seed, reference_time)
+        elif self.checkpoint is not None and os.path.exists(self.checkpoint):
+            # never throw away an interrupted job by starting over its output
+            raise ValueError(f'checkpoint file {self.checkpoint} of an interrupted job exists, '
+                             f'pass --resume to continue it or delete the checkpoint to start over')
+
+        # all randomness goes through per-instance generators, so the whole output is determined by the seed
+        self.random = random.Random(self.seed)
+        self.rstr = rstr.Rstr(self.random)
+        self.faker = Faker()
+        self.faker.seed_instance(self.random.getrandbits(32))
+
+    def settings(self):
+        """Returns generation parameters which must not change between an interrupted job and its resume"""
+
+        return {
+            'schema': self.xsd_file,
+            'schema_sha256': self.xsd_hash,
+            'output': os.path.abspath(self.output) if self.output is not None else None,
+            'element': self.elem,
+            'enable_choice': self.enable_choice,
+            'row_tag': self.row_tag,
+            'row_count': self.row_count,
+            'unbounded_count': self.unbounded_count,
+            'force_optional': self.force_optional,
+            'seed': self.seed,
+            'reference_time': self.reference_time.isoformat(),
+        }
+
+    def load_checkpoint(self, seed, reference_time):
+        """Loads the checkpoint of an interrupted job, taking over its seed and reference time unless specified"""
+
+        if self.output is None or self.checkpoint is None:
+            raise ValueError('resuming a job requires an output file')
+        if not os.path.exists(self.checkpoint):
+            raise ValueError(f'checkpoint file {self.checkpoint} not found')
+        # an incomplete checkpoint, or one written by another version, cannot be resumed from
+        try:
+            with open(self.checkpoint) as f:
+                state = json.load(f)
+        except ValueError:
+            state = None
+        checkpoint_keys = {'settings', 'row_loop', 'row', 'offset', 'random_state', 'faker_state'}
+        if (not isinstance(state, dict) or not checkpoint_keys <= state.keys()
+                or not isinstance(state['settings'], dict) or not self.settings().keys() <= state['settings'].keys()):
+            raise ValueError(f'checkpoint file {self.checkpoint} is not valid')
+
+        if seed is None:
+            self.seed = state['settings']['seed']
+        if reference_time is None:
+            self.reference_time = datetime.fromisoformat(state['settings']['reference_time'])
+        for k, v in self.settings().items():
+            if state['settings'][k] != v:
+                raise ValueError(f'{k} differs from the interrupted job: {v!r} != {state["settings"][k]!r}')
+        # resuming over a missing or shortened output would leave a gap in the generated xml
+        if not os.path.exists(self.output):
+            raise ValueError(f'output file {self.output} of the interrupted job not found')
+        if os.path.getsize(self.output) < state['offset']:
+            raise ValueError(f'output file {self.output} is shorter than at the checkpoint '
+                             f'({os.path.getsize(self.output)} < {state["offset"]} bytes)')
+        self.resume_state = state
+
+    def save_checkpoint(self, row):
+        """Saves the row index, generator states and output offset, so the job can be resumed from this row"""
+
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        state = {
+            'settings': self.settings(),
+            'row_loop': self.row_loop,
+            'row': row,
+            'offset': self.out.tell(),
+            'random_state': self.random.getstate(),
+            'faker_state': self.faker.random.getstate(),
+        }
+        # replace the previous checkpoint atomically, so that a crash never leaves a partial one
+        tmp_file = self.checkpoint + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.checkpoint)
+
+    @staticmethod
+    def rng_state(state):
+        """Converts random generator state loaded from JSON back to the tuple form expected by setstate()"""
+
+        version, internal_state, gauss_next = state
+        return version, tuple(internal_state), gauss_next
+
+    def resume_rows(self) -> int:
+        """Returns index of the first row to generate in the current row section.
+
+        When a resumed job reaches the row section it was interrupted in, generator states are restored
+        from the checkpoint, output written after the checkpoint is dropped and output is switched back on.
+        """
+
+        state = self.resume_state
+        if state is None or state['row_loop'] != self.row_loop:
+            return 0
+        self.random.setstate(self.rng_state(state['random_state']))
+        self.faker.random.setstate(self.rng_state(state['faker_state']))
+        self.out.truncate(state['offset'])
+        self.out.seek(state['offset'])
+        self.resume_state = None
+        self.silent = False
+        return state['row']
+
+    def emit(self, line):
+        """Writes a line of output, unless a resumed job is still replaying the already written part"""
+
+        if not self.silent:
+            self.out.write(line.encode('utf-8') + b'\n')
 
     # shorten the namespace
     def short_ns(self, ns):
@@ -124,11 +258,10 @@ class GenXML:
             return name[x + 1:]
         return name
 
-    @staticmethod
-    def print_header():
+    def print_header(self):
         """Prints XML header"""
 
-        print("<?xml version=\"1.0\" encoding=\"UTF-8\" ?>")
+        self.emit("<?xml version=\"1.0\" encoding=\"UTF-8\" ?>")
 
     # put all defined namespaces as a string
     def ns_map_str(self):
@@ -162,8 +295,7 @@ class GenXML:
     def end_tag(self, name):
         return '</' + name + '>'
 
-    @staticmethod
-    def generate_decimal(node_type) -> str:
+    def generate_decimal(self, node_type) -> str:
         """Generates decimal string within restricted number of digits before and after decimal point
         """
 
@@ -174,13 +306,13 @@ class GenXML:
                 total_digits = int(aRestriction.value)
             elif isinstance(aRestriction, XsdFractionDigitsFacet):
                 fraction_digits = int(aRestriction.value)
-        value_digits = random.randint(1, total_digits)
-        value_fraction_digits = random.randint(0, min(value_digits - 1, fraction_digits))
+        value_digits = self.random.randint(1, total_digits)
+        value_fraction_digits = self.random.randint(0, min(value_digits - 1, fraction_digits))
         if value_fraction_digits == 0:
-            return str(random.randint(0, 10 ** value_digits))
+            return str(self.random.randint(0, 10 ** value_digits))
         else:
             return str(
-                f"{random.randint(0, 10 ** (value_digits - value_fraction_digits))}.{random.randint(0, 10 ** value_fraction_digits)}")
+                f"{self.random.randint(0, 10 ** (value_digits - value_fraction_digits))}.{self.random.randint(0, 10 ** value_fraction_digits)}")
 
     def generate_string(self, node_type: XsdAtomicRestriction) -> str:
         """Generates string applying following types of facets:
@@ -200,10 +332,10 @@ class GenXML:
                     reg_ex_pattern = '[a-zA-Z0-9 ]{20}'
                     for aPattern in node_type.patterns:
                         reg_ex_pattern = aPattern.get('value')
-                    s_value = rstr.xeger(reg_ex_pattern)
+                    s_value = self.rstr.xeger(reg_ex_pattern)
                 elif isinstance(node_type.facets[aFacet], XsdEnumerationFacets):
                     if len(node_type.enumeration) > 0:
-                        enum_ix = random.randint(0, len(node_type.enumeration) - 1)
+                        enum_ix = self.random.randint(0, len(node_type.enumeration) - 1)
                         s_value = node_type.enumeration[enum_ix]
                 elif isinstance(node_type.facets[aFacet], XsdMinLengthFacet):
                     min_len = node_type.min_length
@@ -214,15 +346,14 @@ class GenXML:
                     s_value = '*** Unexpected facet ***'
 
         if b_mod_len:
-            a_len = random.randint(min_len, max_len)
+            a_len = self.random.randint(min_len, max_len)
             s_value = s_value[:a_len]
         return s_value
 
-    @staticmethod
-    def generate_boolean(node_type: XsdAtomicRestriction) -> str:
+    def generate_boolean(self, node_type: XsdAtomicRestriction) -> str:
         """Generates random value of true or false"""
 
-        if random.randint(0, 1) == 1:
+        if self.random.randint(0, 1) == 1:
             return 'true'
 
         return 'false'
@@ -230,20 +361,23 @@ class GenXML:
     def generate_datetime(self, node_type: XsdAtomicRestriction) -> str:
         """Generates random dateTime between a year ago and a year into future"""
 
-        rand_datetime = self.faker.date_time_between(start_date='-1y', end_date='+1y')
+        rand_datetime = self.faker.date_time_between(start_date=self.reference_time - timedelta(days=365),
+                                                      end_date=self.reference_time + timedelta(days=365))
         s_ret_val = datetime.strftime(rand_datetime, '%Y-%m-%dT%H:%M:%S.%f')
         return str(f"{s_ret_val[:23]}Z")
 
     def generate_date(self, node_type: XsdAtomicRestriction) -> str:
         """Generates random date between a year ago and a year into the future"""
 
-        random_datetime = self.faker.date_between(start_date='-1y', end_date='+1y')
+        random_datetime = self.faker.date_between(start_date=self.reference_time.date() - timedelta(days=365),
+                                                  end_date=self.reference_time.date() + timedelta(days=365))
         return datetime.strftime(random_datetime, '%Y-%m-%d')
 
     def generate_gregorian_year(self, node_type) -> str:
         """Generates a random year between 20 years ago and 20 year into the future"""
 
-        random_datetime = self.faker.date_between(start_date='-20y', end_date='+20y')
+        random_datetime = self.faker.date_between(start_date=self.reference_time.date() - timedelta(days=20 * 365),
+                                                  end_date=self.reference_time.date() + timedelta(days=20 * 365))
         return datetime.strftime(random_datetime, '%Y')
 
     def genval(self, name, node_type):
@@ -270,7 +404,7 @@ class GenXML:
             if content_type == 'decimal':
                 return self.generate_decimal(node_type)
 
-        print('<!-- Hardcoded content value -->')
+        self.emit('<!-- Hardcoded content value -->')
         name = self.remove_ns(name)
         if name in self.vals:
             return self.vals[name]
@@ -285,13 +419,13 @@ class GenXML:
         nextg = g._group
         y = len(nextg)
         if y == 0:
-            print('<!--empty-->')
+            self.emit('<!--empty-->')
             return
 
         # print('<!--START:[' + model + ']-->')
         if self.enable_choice and model == 'choice':
             # print('<!-- a random item from a [choice] group with size=' + str(y) + '-->')
-            ixChoice = random.randint(0, y - 1)
+            ixChoice = self.random.randint(0, y - 1)
             ng = nextg[ixChoice]
             if isinstance(ng, XsdElement):
                 self.node2xml(ng)
@@ -331,10 +465,10 @@ class GenXML:
         if node.max_occurs is not None:  # is max_occurs specified?
             if node.max_occurs == 'unbounded':
                 max_occur = self.unbounded_count
-                print(f'<!-- next is repeatable (maxOccurs == unbounded)-->')
+                self.emit(f'<!-- next is repeatable (maxOccurs == unbounded)-->')
             else:
                 if node.max_occurs > 1:
-                    print(f'<!-- next element is repeatable (maxOccurs == {node.max_occurs})-->')
+                    self.emit(f'<!-- next element is repeatable (maxOccurs == {node.max_occurs})-->')
                 if self.remove_ns(node.name) == self.row_tag:
                     # handle row_tag and row_count when number of rows is limited by XSD
                     max_occur = min(self.row_count, node.max_occurs)
@@ -345,22 +479,29 @@ class GenXML:
             # xmlschema doesn't seem to handle 'unbounded' string in the node.max_occurs property
             if node.schema_elem.attrib['maxOccurs'] == 'unbounded':
                 max_occur = self.unbounded_count
-                print(f'<!-- next is repeatable (maxOccurs == unbounded)-->')
+                self.emit(f'<!-- next is repeatable (maxOccurs == unbounded)-->')
                 # handle row_tag and row_count when number of rows is unbounded in XSD
                 if self.remove_ns(node.name) == self.row_tag:
                     max_occur = self.row_count
             else:
-                print('<!-- maxOccurs attribute not found -->')
+                self.emit('<!-- maxOccurs attribute not found -->')
 
         # handle row_tag and row_count
-        if self.remove_ns(node.name) == self.row_tag:
+        is_row = self.remove_ns(node.name) == self.row_tag
+        first_row = 0
+        if is_row:
             no_occurance = max_occur
+            self.row_loop += 1
+            first_row = self.resume_rows()
         else:
-            no_occurance = random.randint(min_occur, max_occur)
+            no_occurance = self.random.randint(min_occur, max_occur)
+
+        for i in range(first_row, no_occurance):
+            if is_row and self.checkpoint_every > 0 and i > first_row and i % self.checkpoint_every == 0:
+                self.save_checkpoint(i)
 
-        for i in range(no_occurance):
             if isinstance(node, XsdAnyElement):
-                print('<_ANY_/>')
+                self.emit('<_ANY_/>')
 
             if isinstance(node.type, XsdComplexType):
                 n = self.use_short_ns(node.name)
@@ -376,38 +517,61 @@ class GenXML:
                     # treat as simple - this a simple base type modified
                     # tp2 = str(self.getContentType(node))
                     # tp = str(node.type.base_type)
-                    print(self.start_tag(n, node) + self.genval(tp, a_content_type) + self.end_tag(n))
+                    self.emit(self.start_tag(n, node) + self.genval(tp, a_content_type) + self.end_tag(n))
                 else:
                     # print('<!--complex content-->')
-                    print(self.start_tag(n, node))
+                    self.emit(self.start_tag(n, node))
                     self.group2xml(node.type.content)
-                    print(self.end_tag(n))
+                    self.emit(self.end_tag(n))
             elif isinstance(node.type, XsdAtomicBuiltin):
                 n = self.use_short_ns(node.name)
                 tp = str(node.type.name)
-                print(self.start_tag(n, node) + self.genval(tp) + self.end_tag(n))
+                self.emit(self.start_tag(n, node) + self.genval(tp) + self.end_tag(n))
             elif isinstance(node.type, XsdSimpleType):
                 n = self.use_short_ns(node.name)
                 if isinstance(node.type, XsdList):
-                    print('<!--simpletype: list-->')
+                    self.emit('<!--simpletype: list-->')
                     tp = str(node.type.item_type.name)
-                    print(self.start_tag(n, node) + self.genval(tp) + self.end_tag(n))
+                    self.emit(self.start_tag(n, node) + self.genval(tp) + self.end_tag(n))
                 elif isinstance(node.type, XsdUnion):
-                    print('<!--simpletype: union.-->')
-                    print('<!--default: using the 1st type-->')
+                    self.emit('<!--simpletype: union.-->')
+                    self.emit('<!--default: using the 1st type-->')
                     tp = str(node.type.member_types[0].base_type.name)
-                    print(self.start_tag(n, node) + self.genval(tp) + self.end_tag(n))
+                    self.emit(self.start_tag(n, node) + self.genval(tp) + self.end_tag(n))
                 else:
                     tp = str(node.type.base_type.name)
-                    print(self.start_tag(n, node) + self.genval(tp, node.type) + self.end_tag(n))
+                    self.emit(self.start_tag(n, node) + self.genval(tp, node.type) + self.end_tag(n))
             else:
-                print('ERROR: unknown type: ' + node.type)
+                self.emit('ERROR: unknown type: ' + node.type)
 
     # setup and print everything
     def run(self):
         valsmap(self.vals)
-        self.print_header()
-        self.node2xml(self.xsd.elements[self.elem])
+        # stdout may carry the xml, so report what reproduces this output on stderr
+        print(f'seed: {self.seed}, reference time: {self.reference_time.isoformat()}', file=sys.stderr)
+        if self.output is None:
+            self.out = sys.stdout.buffer
+        elif self.resume_state is not None:
+            # replay silently up to the checkpointed row, the output is only modified once it is reached
+            self.out = open(self.output, 'r+b')
+            self.silent = True
+        else:
+            self.out = open(self.output, 'wb')
+
+        try:
+            self.print_header()
+            self.node2xml(self.xsd.elements[self.elem])
+        finally:
+            if self.output is None:
+                self.out.flush()
+            else:
+                self.out.close()
+
+        if self.resume_state is not None:
+            raise ValueError('row section of the interrupted job not reached while resuming')
+        # the job is complete, there is nothing left to resume
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
 
 
 ##############
@@ -434,14 +598,47 @@ def main():
     parser.add_argument("-fopt", "--forceoptional",
                         dest="force_optional", default="False",
                         help="Force creation of optional elements. (True / False)")
+    parser.add_argument("-seed", "--seed",
+                        dest="seed", default=None,
+                        help="Seed for random data, the same seed generates the same output. Random if not specified.")
+    parser.add_argument("-rtm", "--referencetime",
+                        dest="reference_time", default=None,
+                        help="Generated dates are relative to this ISO date/time. (Defaults to now, combine with --seed for reproducible output)")
+    parser.add_argument("-o", "--output",
+                        dest="output", default=None,
+                        help="Write xml to this file instead of standard output. Required for checkpoints.")
+    parser.add_argument("-ckpt", "--checkpoint",
+                        dest="checkpoint", default=None,
+                        help="Checkpoint file of the job. (Defaults to output file name with .ckpt suffix)")
+    parser.add_argument("-ckev", "--checkpointevery",
+                        dest="checkpoint_every", default="10000",
+                        help="Save a checkpoint every N rows of --rowtag elements. (0 disables checkpoints)")
+    parser.add_argument("-res", "--resume",
+                        action="store_true", dest="resume", default=False,
+                        help="Continue an interrupted job from its last checkpoint.")
     args = parser.parse_args()
 
+    checkpoint = None
+    checkpoint_every = 0
+    if args.output is not None:
+        checkpoint = args.checkpoint if args.checkpoint is not None else args.output + '.ckpt'
+        checkpoint_every = args.checkpoint_every
+    elif args.checkpoint is not None or args.resume:
+        parser.error("--checkpoint and --resume require --output")
+
     # construct and initialise XML Generator object
-    generator = GenXML(args.xsdfile, args.element, args.enable_choice,
-                       args.row_tag, args.row_count, args.unbounded_count, args.force_optional)
+    try:
+        generator = GenXML(args.xsdfile, args.element, args.enable_choice,
+                           args.row_tag, args.row_count, args.unbounded_count, args.force_optional,
+                           args.seed, args.reference_time, args.output, checkpoint, checkpoint_every, args.resume)
+    except ValueError as e:
+        parser.error(str(e))
 
     # run the XML generation procedure
-    generator.run()
+    try:
+        generator.run()
+    except ValueError as e:
+        parser.error(str(e))
 
 
 if __name__ == "__main__":